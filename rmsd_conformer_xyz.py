@@ -1,3 +1,5 @@
+import io
+import mmap
 import numpy as np
 
 #############################################
@@ -10,95 +12,89 @@ import numpy as np
 def read_xyz(file_path):
     """
     Reads an XYZ file and extracts atomic coordinates for each conformer.
+    The file is memory-mapped and only the coordinate lines are copied out for parsing.
+    Coordinates are stored as float32 to halve memory traffic, while calculate_rmsd
+    accumulates in float64. Rounding of the stored coordinates can still move a few
+    RMSD values by one unit in the 4th decimal compared to a full float64 run.
     :param file_path: Path to the XYZ file.
-    :return: List of conformers, where each conformer is a list of coordinates (Nx3 numpy array).
+    :return: Contiguous numpy array of shape (num_conf, N, 3) holding the coordinates of every conformer.
     """
-    with open(file_path, 'r') as f:
-        lines = f.readlines()
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # end offset of every line, found in a single scan over the mapped bytes
+        line_ends = np.flatnonzero(np.frombuffer(mm, dtype=np.uint8) == ord('\n')) + 1
+        if line_ends.size == 0 or line_ends[-1] != len(mm):
+            line_ends = np.append(line_ends, len(mm))  # last line without trailing newline
+        line_starts = np.r_[0, line_ends[:-1]]
 
-    conformers = []
-    i = 0
-    while i < len(lines):
-        num_atoms = int(lines[i].strip())
-        i += 2  # Skip the atom count and comment line
+        num_atoms = int(mm[:line_ends[0]])
+        num_conf = len(line_ends) // (num_atoms + 2)
 
-        coords = []
-        for _ in range(num_atoms):
-            parts = lines[i].strip().split()
-            x, y, z = float(parts[1]), float(parts[2]), float(parts[3])
-            coords.append([x, y, z])
-            i += 1
+        # byte range of the coordinate lines of each conformer, skipping the atom count and comment line
+        first = np.arange(num_conf) * (num_atoms + 2) + 2
+        starts = line_starts[first].tolist()
+        ends = line_ends[first + num_atoms - 1].tolist()
+        buffer = b''.join(mm[start:end] for start, end in zip(starts, ends))
 
-        conformers.append(np.array(coords))
+    # parse all coordinates at once, dropping the element symbol column
+    coords = np.loadtxt(io.BytesIO(buffer), usecols=(1, 2, 3), dtype=np.float32)
 
-    return conformers
+    return coords.reshape(num_conf, num_atoms, 3)
 
 def adjust_relative_to_first_atom(coords):
     """
-    Adjusts atomic coordinates relative to the first atom in the molecule.
-    :param coords: Numpy array of shape (N, 3) representing atomic coordinates.
-    :return: Adjusted numpy array of coordinates.
+    Adjusts atomic coordinates relative to the first atom in the molecule, in place.
+    :param coords: Numpy array of shape (..., N, 3) representing atomic coordinates.
+    :return: The same numpy array, now holding the adjusted coordinates.
     """
-    return coords - coords[0]  # Subtract the coordinates of the first atom
+    coords -= coords[..., 0:1, :]  # Subtract the coordinates of the first atom
+    return coords
 
 def calculate_rmsd(coords1, coords2):
     """
-    Calculates the RMSD between two sets of atomic coordinates.
-    :param coords1: Numpy array of shape (N, 3) for the first conformer.
-    :param coords2: Numpy array of shape (N, 3) for the second conformer.
-    :return: RMSD value.
+    Calculates the RMSD between two sets of atomic coordinates, broadcasting over leading axes.
+    :param coords1: Numpy array of shape (..., N, 3) for the first conformer(s).
+    :param coords2: Numpy array of shape (..., N, 3) for the second conformer(s).
+    :return: RMSD value(s).
     """
     diff = coords1 - coords2
-    return np.sqrt(np.sum(diff ** 2) / len(coords1))
+    return np.sqrt(np.einsum('...ij,...ij->...', diff, diff, dtype=np.float64) / coords1.shape[-2])
 
 def write_rmsd_to_file(rmsd_values, output_file):
     """
     Writes the RMSD values to a file and classifies conformers into categories.
-    :param rmsd_values: List of RMSD values.
+    :param rmsd_values: List or numpy array of RMSD values.
     :param output_file: Path to the output text file.
     """
     
     # manually designed ranges, subject to changes based on needs
-    categories = {
-        'smaller_than_0.5': [],
-        '0.5_to_1.0': [],
-        '1.0_to_2.0': [],
-        'above_2.0': []
-    }
-    
-    # if the above ranges change, the corresponding values below should also be modified
-    for i, rmsd in enumerate(rmsd_values):
-        if rmsd < 0.5:
-            categories['smaller_than_0.5'].append(i + 1)
-        elif 0.5 <= rmsd < 1.0:
-            categories['0.5_to_1.0'].append(i + 1)
-        elif 1.0 <= rmsd < 2.0:
-            categories['1.0_to_2.0'].append(i + 1)
-        else:
-            categories['above_2.0'].append(i + 1)
+    # if the bin edges change, the category names below should also be modified
+    bin_edges = [0.5, 1.0, 2.0]
+    names = ['smaller_than_0.5', '0.5_to_1.0', '1.0_to_2.0', 'above_2.0']
+
+    # index of the range each conformer falls into
+    bin_idx = np.digitize(np.asarray(rmsd_values), bin_edges)
+    categories = {name: (np.flatnonzero(bin_idx == k) + 1).tolist() for k, name in enumerate(names)}
+
+    # build the whole report in memory, then write it at once
+    lines = ["RMSD Values and Classification:\n"]
+    lines.extend(f"Conformer {i+1}: RMSD = {rmsd:.4f} \u00c5\n" for i, rmsd in enumerate(rmsd_values))
+
+    lines.append("\nClassification:\n")
+    lines.extend(f"{category.replace('_', ' ').title()}: {', '.join(map(str, conformers))}\n"
+                 for category, conformers in categories.items())
 
     with open(output_file, 'w') as f:
-        f.write("RMSD Values and Classification:\n")
-        for i, rmsd in enumerate(rmsd_values):
-            f.write(f"Conformer {i+1}: RMSD = {rmsd:.4f} \u00c5\n")
-        
-        f.write("\nClassification:\n")
-        for category, conformers in categories.items():
-            f.write(f"{category.replace('_', ' ').title()}: {', '.join(map(str, conformers))}\n")
+        f.write(''.join(lines))
 
 def main(file_path, output_file):
     # Step 1: Read all conformers from the XYZ file
     conformers = read_xyz(file_path)
     
     # Step 2: Adjust all conformers relative to their first atom
-    adjusted_conformers = [adjust_relative_to_first_atom(c) for c in conformers]
-
-    # Step 3: Calculate RMSD relative to the first conformer
-    reference_conformer = adjusted_conformers[0]
-    rmsd_values = []
-    for i, conformer in enumerate(adjusted_conformers):
-        rmsd = calculate_rmsd(reference_conformer, conformer)
-        rmsd_values.append(rmsd)
+    adjusted_conformers = adjust_relative_to_first_atom(conformers)
+
+    # Step 3: Calculate RMSD of every conformer relative to the first one
+    rmsd_values = calculate_rmsd(adjusted_conformers[0], adjusted_conformers)
 
     # Step 4: Write RMSD values and classification to file
     write_rmsd_to_file(rmsd_values, output_file)
@@ -1,8 +1,11 @@
 import os
 import numpy as np
-import math
 import sys
-import matplotlib.pyplot as plt
+import argparse
+import io
+import mmap
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 
 ####################################
 # This script is aimed to address the following issue: Assuming we have a .xyz file containing a lot of frames,
@@ -27,248 +30,233 @@ import matplotlib.pyplot as plt
 
 # In addition to the file convertion, the script also provided another functionality to calculate the bond distances/bond angles/dihedrals
 # for each frame (conformer) based on specified atom indexes (-l for distance, -a for angle and -d for dihedral). It will save these
-# geometric related values into a separate .txt file under the generated new folder, as well as showing the scatter plot for them
-# in the terminal and saving those plots under current working directory. This functionality is similar to cpptraj module, which is
+# geometric related values into a separate .txt file under the generated new folder, as well as rendering the scatter plot for them
+# headlessly and saving those plots under current working directory. This functionality is similar to cpptraj module, which is
 # commonly used for analyzing MD trajectory results.
 #####################################
 
-# function for calculating bond length
-def calc_length(array,i,j):
-    x = np.array(array[i].split()[1:],dtype=np.float32)
-    y = np.array(array[j].split()[1:],dtype=np.float32)
-    sum_d = 0
-    for v in range(len(x)):
-        sum_d += (x[v]-y[v])**2
-    distance = math.sqrt(sum_d)
-    return round(distance,4)
+# function for reading every conformer of an .xyz file
+# the file is memory-mapped, line offsets are located in one vectorized scan and only coordinate lines are copied out
+# returns a (num_conf, num_atom, 3) coordinate array and the coordinate text block of each conformer
+# float32 is precise enough for Angstrom-scale coordinates, angle arguments are promoted to float64 before arccos/arctan2
+def read_xyz(path):
+    with open(path,'rb') as f, mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) as mm:
+        # end offset of every line
+        line_ends = np.flatnonzero(np.frombuffer(mm,dtype=np.uint8) == ord('\n')) + 1
+        if line_ends.size == 0 or line_ends[-1] != len(mm):
+            # last line without trailing newline
+            line_ends = np.append(line_ends,len(mm))
+        line_starts = np.r_[0,line_ends[:-1]]
+        
+        num_atom = int(mm[:line_ends[0]])
+        num_conf = len(line_ends)//(num_atom+2)
+        
+        # byte range of the coordinate lines of each conformer, skipping the atom count and comment line
+        first = np.arange(num_conf)*(num_atom+2) + 2
+        starts = line_starts[first].tolist()
+        ends = line_ends[first+num_atom-1].tolist()
+        raw_blocks = [mm[start:end] for start, end in zip(starts,ends)]
+    
+    coords = np.loadtxt(io.BytesIO(b''.join(raw_blocks)),usecols=(1,2,3),dtype=np.float32)
+    blocks = [block.decode().replace('\r\n','\n') for block in raw_blocks]
+    return coords.reshape(num_conf,num_atom,3), blocks
+
+# function for calculating bond length of every conformer, or of a single one given a (num_atom, 3) array
+def calc_length(coords,i,j):
+    distance = np.linalg.norm(coords[...,i,:] - coords[...,j,:],axis=-1)
+    return np.round(distance,4)
 
-# function for calculating bond angle
-def calc_angle(array,i,j,k):
-    atomA = np.array(array[i].split()[1:],dtype=np.float32)
-    atomB = np.array(array[j].split()[1:],dtype=np.float32)
-    atomC = np.array(array[k].split()[1:],dtype=np.float32)
+# function for calculating bond angle of every conformer, or of a single one given a (num_atom, 3) array
+def calc_angle(coords,i,j,k):
+    atomA = coords[...,i,:]
+    atomB = coords[...,j,:]
+    atomC = coords[...,k,:]
     AB = atomB - atomA
     BC = atomB - atomC
-    length_AB = math.sqrt(sum(v**2 for v in AB))
-    length_BC = math.sqrt(sum(v**2 for v in BC))
-    cos_angle = np.dot(AB,BC)/(length_AB * length_BC)
-    angle = math.acos(cos_angle)
-    angle = angle * 180 / math.pi
-    return round(angle,4)
+    length_AB = np.linalg.norm(AB,axis=-1)
+    length_BC = np.linalg.norm(BC,axis=-1)
+    cos_angle = np.einsum('...i,...i->...',AB,BC)/(length_AB * length_BC)
+    angle = np.degrees(np.arccos(np.clip(cos_angle.astype(np.float64),-1,1)))
+    return np.round(angle,4)
 
-# function for calculating dihedral
-def calc_dihedral(array,i,j,k,m):
-    atomA = np.array(array[i].split()[1:],dtype=np.float32)
-    atomB = np.array(array[j].split()[1:],dtype=np.float32)
-    atomC = np.array(array[k].split()[1:],dtype=np.float32)
-    atomD = np.array(array[m].split()[1:],dtype=np.float32)
+# function for calculating dihedral of every conformer, or of a single one given a (num_atom, 3) array
+def calc_dihedral(coords,i,j,k,m):
+    atomA = coords[...,i,:]
+    atomB = coords[...,j,:]
+    atomC = coords[...,k,:]
+    atomD = coords[...,m,:]
     AB = atomB - atomA
     BC = atomC - atomB
     CD = atomD - atomC
     n1 = np.cross(AB,BC)
     n2 = np.cross(BC,CD)
-    norm_n1 = math.sqrt(sum(v**2 for v in n1))
-    norm_n2 = math.sqrt(sum(v**2 for v in n2))
-    cos_dihedral = np.dot(n1,n2)/(norm_n1 * norm_n2)
-    dihedral = math.acos(cos_dihedral)
-    dihedral = dihedral * 180 / math.pi
+    # signed dihedral from atan2, no separate sign fix-up needed
+    x = np.einsum('...i,...i->...',n1,n2)
+    y = np.einsum('...i,...i->...',np.cross(n1,n2),BC)/np.linalg.norm(BC,axis=-1)
+    dihedral = np.degrees(np.arctan2(y.astype(np.float64),x.astype(np.float64)))
     
-    n3 = np.cross(n1,n2)
-    if np.dot(n3,BC) < 0:
-        dihedral = -dihedral
+    return np.round(dihedral,4)
+
+# function for writing the g16 input file of a single conformer
+def write_one(i,preamble,head,blocks,tail,base,chk_base,bool_chk):
+    # file name generated, assigned index based on original order
+    path_save = f'{base}/crest_conformers_{i+1}.com'
+    
+    # checkpoint file keyword
+    chk_line = f'%chk={chk_base}{i+1}.chk\n' if bool_chk else ''
     
-    return round(dihedral,4)
+    # part controlling writing the g16 input files
+    with open(path_save,'w+') as f1:
+        f1.write(preamble + chk_line + head + blocks[i] + tail)
 
 def main(path,folder_name):
-    with open(path,'r') as f:
-        data = f.readlines()
-        line_s = str(data[0]).strip() 
-        # number of atoms for the molecule
-        num_atom = int(line_s.strip('\n')) 
-        # number of conformers from CREST
-        num_conf = int(len(data)/(num_atom+2)) 
-        # threshold of conformers' number we want for file conversion
-        trsd = num_conf 
-
-        # check whether user wants to specify g16 input keywords instead of using defaults
-        length = len(sys.argv) 
-        
-        # lists for geometric properties storage
-        bd_length_asb = []
-        angle_asb = []
-        dihedral_asb = []
+    # read keywords from the command line
+    parser = argparse.ArgumentParser(description='Convert each conformer of a CREST ensemble into a Gaussian 16 input file.')
+    parser.add_argument('-l', nargs=2, type=int, help='atom indexes for bond length')
+    parser.add_argument('-a', nargs=3, type=int, help='atom indexes for bond angle')
+    parser.add_argument('-d', nargs=4, type=int, help='atom indexes for dihedral')
+    parser.add_argument('-n', type=int, default=None, help='number of conformers converted (default: all)')
+    parser.add_argument('-c', default='24', help='number of CPUs for g16 calculation')
+    parser.add_argument('-m', default='48', help='memory (GB) for g16 calculation')
+    parser.add_argument('-chk', action='store_true', help='save checkpoint file')
+    args = parser.parse_args()
+    
+    # atomic coordinates and coordinate text blocks of all conformers, parsed once
+    coords, blocks = read_xyz(path)
+    # number of conformers from CREST and number of atoms for the molecule
+    num_conf, num_atom, _ = coords.shape
+    
+    # lists for geometric properties storage
+    bd_length_asb = []
+    angle_asb = []
+    dihedral_asb = []
+    
+    # indexes used to store bond distances related atoms
+    bd_atm1, bd_atm2 = [v+1 for v in args.l] if args.l else (0, 0)
+    
+    # indexes used to store bond angles related atoms
+    angle_atm1, angle_atm2, angle_atm3 = [v+1 for v in args.a] if args.a else (0, 0, 0)
+    
+    # indexes used to store dihedral related atoms
+    dihedral_atm1, dihedral_atm2, dihedral_atm3, dihedral_atm4 = [v+1 for v in args.d] if args.d else (0, 0, 0, 0)
+    
+    # check the specified atom indexes exist in the molecule
+    atom_indexes = (args.l or []) + (args.a or []) + (args.d or [])
+    if any(v < 1 or v > num_atom for v in atom_indexes):
+        parser.error(f'atom indexes should be between 1 and {num_atom}')
+    # check the number of converted conformers does not exceed the ensemble size
+    if args.n is not None and not 0 <= args.n <= num_conf:
+        parser.error(f'number of conformers should be between 0 and {num_conf}')
+    
+    # threshold of conformers' number we want for file conversion
+    trsd = args.n if args.n is not None else num_conf
+    # number of CPUs for g16 calculation
+    core = '%nprocshared=' + args.c + '\n' 
+    # number of memory for g16 calculation
+    mem = '%mem=' + args.m + 'GB\n' 
+    # whether you need to save checkpoint file
+    bool_chk = args.chk
+    
+    # list used to store input keywords info
+    inpMB = []
+    
+    # file containing g16 input keyword info
+    input_filename = 'input.txt' 
+    input_filepath = os.path.join(os.getcwd(),input_filename)
+    
+    if os.path.isfile(input_filepath):
+        # read from existing g16 input keyword file
+        with open(input_filepath,'r') as f5:
+            info = f5.readlines()
+            inpMB = info
+    else:
+        # default setting of method and basis set without provided keywords
+        inpMB.append('# opt freq b3lyp/def2svp em=gd3bj\n')
+        inpMB.append('\n')
+        inpMB.append('Title\n')
+        inpMB.append('\n')
+        inpMB.append('0 1\n') 
         
-        # indexes used to store bond distances related atoms
-        bd_atm1 = 0
-        bd_atm2 = 0
+    # check if the saved folder already exists
+    if not os.path.exists(folder_name):
+        os.mkdir(folder_name)
+    else:
+        print(f'Folder {folder_name} already exists.')
+        sys.exit()
         
-        # indexes used to store bond angles related atoms
-        angle_atm1 = 0
-        angle_atm2 = 0
-        angle_atm3 = 0
+    # path prefixes shared by every conformer
+    cwd = os.getcwd()
+    base = './' + folder_name
+    chk_base = cwd + '/' + folder_name + '/crest_conformers_'
+    
+    # conformer indexes used as the first column of geometric property files
+    conf_index = np.arange(1,trsd+1)
+    
+    # calculate and write bond distances info based on atom pairs if specified
+    if args.l:
+        path_bd_length = base + '/bond_length.txt'
+        bd_length_asb = calc_length(coords[:trsd],bd_atm1-2,bd_atm2-2)
+        np.savetxt(path_bd_length,np.c_[conf_index,bd_length_asb],fmt=['%d','%.4f'],delimiter='\t')
         
-        # indexes used to store dihedral related atoms
-        dihedral_atm1 = 0
-        dihedral_atm2 = 0
-        dihedral_atm3 = 0
-        dihedral_atm4 = 0
+    # calculate and write bond angles info based on atom pairs if specified
+    if args.a:
+        path_angle = base + '/angle.txt'
+        angle_asb = calc_angle(coords[:trsd],angle_atm1-2,angle_atm2-2,angle_atm3-2)
+        np.savetxt(path_angle,np.c_[conf_index,angle_asb],fmt=['%d','%.4f'],delimiter='\t')
         
-        # number of CPUs for g16 calculation
-        core = '%nprocshared=24\n' 
-        # number of memory for g16 calculation
-        mem = '%mem=48GB\n' 
-        # whether you need to save checkpoint file
-        bool_chk = False 
+    # calculate and write dihedrals info based on atom pairs if specified
+    if args.d:
+        path_dihedral = base + '/dihedral.txt'
+        dihedral_asb = calc_dihedral(coords[:trsd],dihedral_atm1-2,dihedral_atm2-2,dihedral_atm3-2,dihedral_atm4-2)
+        np.savetxt(path_dihedral,np.c_[conf_index,dihedral_asb],fmt=['%d','%.4f'],delimiter='\t')
         
-        # list used to store input keywords info
-        inpMB = []
+    # parts of the g16 input files shared by every conformer, built once
+    # memory and CPU keywords
+    preamble = mem + core
+    # basic parts, usually just first 5 lines
+    # including calculation keyword, notes, charge and multiplicity settings
+    head = ''.join(inpMB[:5])
+    # advanced parts, including settings like constrain, scan or ECP basis sets
+    tail = ''.join(inpMB[5:]) + '\n'
+    # without a checkpoint keyword in between, memory/CPU keywords and basic parts can be joined once as well
+    if(bool_chk == False):
+        preamble, head = preamble + head, ''
+    
+    # g16 input files are independent of each other, write them concurrently
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+        list(ex.map(write_one, range(trsd), repeat(preamble), repeat(head), repeat(blocks), repeat(tail), repeat(base), repeat(chk_base), repeat(bool_chk)))
+
+    if(len(bd_length_asb) or len(angle_asb) or len(dihedral_asb)):
+        # import matplotlib only when plots are needed, using the non-interactive backend
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
         
-        # file containing g16 input keyword info
-        input_filename = 'input.txt' 
-        input_filepath = os.path.join(os.getcwd(),input_filename)
+    if(len(bd_length_asb) != 0):
+        # draw plot for bond length changes
+        x = np.arange(len(bd_length_asb))
+        plt.plot(x,bd_length_asb,'o',color='blue')
+        plt.title('Bond length changes bewteen ' + str(bd_atm1-1) + ' and ' + str(bd_atm2-1) )
+        plt.savefig('Bond_'+str(bd_atm1-1)+'and'+str(bd_atm2-1)+'.png', dpi=150)
+        plt.close()
         
-        if os.path.isfile(input_filepath):
-            # read from existing g16 input keyword file
-            with open(input_filepath,'r') as f5:
-                info = f5.readlines()
-                inpMB = info
-        else:
-            # default setting of method and basis set without provided keywords
-            inpMB.append('# opt freq b3lyp/def2svp em=gd3bj\n')
-            inpMB.append('\n')
-            inpMB.append('Title\n')
-            inpMB.append('\n')
-            inpMB.append('0 1\n') 
-            
-        if (length > 1):
-                for k in range(length):
-                    # read bond length keyword
-                    if(sys.argv[k] == '-l'):
-                        bd_atm1 = int(sys.argv[k+1])+1
-                        bd_atm2 = int(sys.argv[k+2])+1 
-                    # read bond angle keyword
-                    elif(sys.argv[k] == '-a'):
-                        angle_atm1 = int(sys.argv[k+1])+1
-                        angle_atm2 = int(sys.argv[k+2])+1
-                        angle_atm3 = int(sys.argv[k+3])+1 
-                    # read dihedral keyword
-                    elif(sys.argv[k] == '-d'):
-                        dihedral_atm1 = int(sys.argv[k+1])+1
-                        dihedral_atm2 = int(sys.argv[k+2])+1
-                        dihedral_atm3 = int(sys.argv[k+3])+1
-                        dihedral_atm4 = int(sys.argv[k+4])+1 
-                    # read number of conformers converted keyword
-                    elif(sys.argv[k] == '-n'):
-                        trsd = int(sys.argv[k+1]) 
-                    # read core info keyword
-                    elif(sys.argv[k] == '-c'):
-                        core = '%nprocshared=' + sys.argv[k+1] + '\n' 
-                    # read memory keyword
-                    elif(sys.argv[k] == '-m'):
-                        mem = '%mem=' + sys.argv[k+1] + 'GB\n' 
-                    # read .chk file keyword
-                    elif(sys.argv[k] == '-chk'):
-                        bool_chk = True 
+    if(len(angle_asb) != 0):
+        # draw plot for bond angle changes
+        x = np.arange(len(angle_asb))
+        plt.plot(x,angle_asb,'o',color='blue')
+        plt.title('Angle changes among ' + str(angle_atm1-1) + ', ' + str(angle_atm2-1) + ' and ' +str(angle_atm3-1))
+        plt.savefig('Angle_'+str(angle_atm1-1)+'_'+str(angle_atm2-1)+'and'+str(angle_atm3-1)+'.png', dpi=150)
+        plt.close()
         
-        # check if the saved folder already exists
-        if not os.path.exists(folder_name):
-            os.mkdir(folder_name)
-        else:
-            print(f'Folder {folder_name} already exists.')
-            sys.exit()
-            
-        for i in range(trsd):
-            # write bond distances info based on atom pairs if specified
-            if(bd_atm1 >=2 and bd_atm2 >=2):
-                path_bd_length = './' + folder_name + '/bond_length.txt'
-                bd_length_new = calc_length(data,bd_atm1+i*(num_atom+2),bd_atm2+i*(num_atom+2))
-                bd_length_asb.append(bd_length_new)
-                with open(path_bd_length,'a') as f2:
-                    f2.write(str(i+1) + '\t')
-                    f2.write(str(bd_length_new))
-                    f2.write('\n')
-                    
-             # write bond angles info based on atom pairs if specified        
-            if(angle_atm1 >=2 and angle_atm2 >=2 and angle_atm3 >=2):
-                path_angle = './' + folder_name + '/angle.txt'
-                angle_new = calc_angle(data,angle_atm1+i*(num_atom+2),angle_atm2+i*(num_atom+2),angle_atm3+i*(num_atom+2))
-                angle_asb.append(angle_new)
-                with open(path_angle,'a') as f3:
-                    f3.write(str(i+1) + '\t')
-                    f3.write(str(angle_new))
-                    f3.write('\n')
-                    
-            # write dihedrals info based on atom pairs if specified        
-            if(dihedral_atm1 >=2 and dihedral_atm2 >=2 and dihedral_atm3 >=2 and dihedral_atm4 >=2):
-                path_dihedral = './' + folder_name + '/dihedral.txt'
-                dihedral_new = calc_dihedral(data,dihedral_atm1+i*(num_atom+2),dihedral_atm2+i*(num_atom+2),dihedral_atm3+i*(num_atom+2),dihedral_atm4+i*(num_atom+2))
-                dihedral_asb.append(dihedral_new)
-                with open(path_dihedral,'a') as f4:
-                    f4.write(str(i+1) + '\t')
-                    f4.write(str(dihedral_new))
-                    f4.write('\n')
-            
-            # file name generated, assigned index based on original order
-            path_save = './' + folder_name + "/crest_conformers_" + str(i+1) + '.com'
-            
-            # part controlling writing the g16 input files
-            with open(path_save,'w+') as f1:
-                # write memory keyword
-                f1.write(mem) 
-                # write CPU keyword
-                f1.write(core) 
-                
-                if(bool_chk == True):
-                    # write checkpoint file keyword
-                    path_save_chk = os.getcwd() + '/' + folder_name + "/crest_conformers_" + str(i+1) + '.chk'
-                    f1.write('%chk=' + path_save_chk + '\n')
-                    
-                if(len(inpMB) <= 5):
-                    # cases only writing basic parts for g16 input files 
-                    # usually just first 5 lines 
-                    # including calculation keyword, notes, charge and multiplicity settings
-                    for k in range(len(inpMB)):
-                        f1.write(inpMB[k])
-                    for j in range(num_atom):
-                        f1.write(data[2+j+i*(num_atom+2)])
-                    f1.write('\n')
-                    
-                elif(len(inpMB) > 5):
-                    # cases also writing advanced parts for g16 input files
-                    # including settings like constrain, scan or ECP basis sets
-                    for k in range(5):
-                        f1.write(inpMB[k])
-                    for j in range(num_atom):
-                        f1.write(data[2+j+i*(num_atom+2)])
-                    for m in range(len(inpMB)-5):
-                        f1.write(inpMB[m+5])
-                    f1.write('\n')
+    if(len(dihedral_asb) != 0):
+        # draw plot for dihedral changes
+        x = np.arange(len(dihedral_asb))
+        plt.plot(x,dihedral_asb,'o',color='blue')
+        plt.title('Dihedral changes among ' + str(dihedral_atm1-1) + ', ' + str(dihedral_atm2-1) + ', ' + str(dihedral_atm3-1) + ' and ' + str(dihedral_atm4-1))
+        plt.savefig('Dihedral_'+str(dihedral_atm1-1)+'_'+str(dihedral_atm2-1)+'_'+str(dihedral_atm3-1)+'and'+str(dihedral_atm4-1)+'.png', dpi=150)
+        plt.close()
+
 
-        if(len(bd_length_asb) != 0):
-            # draw plot for bond length changes
-            x = np.array([i for i in range(len(bd_length_asb))])
-            plt.scatter(x,bd_length_asb, color='blue', marker='o')
-            plt.title('Bond length changes bewteen ' + str(bd_atm1-1) + ' and ' + str(bd_atm2-1) )
-            plt.savefig('Bond_'+str(bd_atm1-1)+'and'+str(bd_atm2-1)+'.png', dpi=1000)
-            plt.show()
-            
-        if(len(angle_asb) != 0):
-            # draw plot for bond angle changes
-            x = np.array([i for i in range(len(angle_asb))])
-            plt.scatter(x,angle_asb, color='blue', marker='o')
-            plt.title('Angle changes among ' + str(angle_atm1-1) + ', ' + str(angle_atm2-1) + ' and ' +str(angle_atm3-1))
-            plt.savefig('Angle_'+str(angle_atm1-1)+'_'+str(angle_atm2-1)+'and'+str(angle_atm3-1)+'.png', dpi=1000)
-            plt.show() 
-            
-        if(len(dihedral_asb) != 0):
-            # draw plot for dihedral changes
-            x = np.array([i for i in range(len(dihedral_asb))])
-            plt.scatter(x,dihedral_asb, color='blue', marker='o')
-            plt.title('Dihedral changes among ' + str(dihedral_atm1-1) + ', ' + str(dihedral_atm2-1) + ', ' + str(dihedral_atm3-1) + ' and ' + str(dihedral_atm4-1))
-            plt.savefig('Dihedral_'+str(dihedral_atm1-1)+'_'+str(dihedral_atm2-1)+'_'+str(dihedral_atm3-1)+'and'+str(dihedral_atm4-1)+'.png', dpi=1000)
-            plt.show() 
-    
-    
 if __name__ == "__main__":
     # This is usually the default file name generated from CREST run
     path = './crest_conformers.xyz' # Replace with your actual file path for other needs